@@ -1,26 +1,66 @@
 #!/usr/bin/env python3
 """
 下载 rime-ice 词库并转换为项目可用的 SQLite 格式
-需要安装: pip install requests
+需要安装: pip install requests pyyaml
 """
 
 import os
 import sys
-import subprocess
 import shutil
+import sqlite3
 import tempfile
+from operator import itemgetter
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+import yaml
 import zipfile
 
 # rime-ice GitHub 仓库信息
 RIME_ICE_REPO = "iDvel/rime-ice"
 RIME_ICE_API = f"https://api.github.com/repos/{RIME_ICE_REPO}"
 
-def get_latest_release_url():
+# dict.yaml 头部优先使用 libyaml 的 C 解析器
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# 下载的 ZIP 在内存中缓存的上限，超过后才写入临时文件
+DOWNLOAD_SPOOL_SIZE = 256 << 20
+
+# 下载进度的刷新间隔（字节）
+PROGRESS_INTERVAL = 4 << 20
+
+# 读取词库文件时使用的缓冲区大小
+READ_BUFFER_SIZE = 1 << 20
+
+# SQLite 表结构，与 convert_rime_dict.swift 生成的数据库保持一致
+SQLITE_CREATE_TABLE = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    code_raw TEXT NOT NULL,
+    code_norm TEXT NOT NULL,
+    word TEXT NOT NULL,
+    weight INTEGER DEFAULT 0
+)
+"""
+SQLITE_CREATE_INDEX = "CREATE INDEX idx_entries_code_norm ON entries(code_norm)"
+SQLITE_INSERT = "INSERT INTO entries (code_raw, code_norm, word, weight) VALUES (?, ?, ?, ?)"
+
+# 每次 executemany 提交的行数
+SQLITE_BATCH_SIZE = 50000
+
+# 写入 YAML 时每批拼接的行数
+WRITE_BATCH_SIZE = 10000
+
+def create_session():
+    """创建下载用的 HTTP 会话，多次请求复用连接"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(max_retries=3, pool_connections=4))
+    return session
+
+def get_latest_release_url(session):
     """获取最新 release 的下载 URL"""
     try:
-        response = requests.get(f"{RIME_ICE_API}/releases/latest", timeout=10)
+        response = session.get(f"{RIME_ICE_API}/releases/latest", timeout=10)
         if response.status_code == 200:
             data = response.json()
             # 查找 full.zip 或 source code zip
@@ -35,12 +75,12 @@ def get_latest_release_url():
     return None
 
 # 尝试多个可能的下载 URL
-def get_download_urls():
+def get_download_urls(session):
     """获取所有可能的下载 URL（按优先级排序）"""
     urls = []
     
     # 1. 尝试最新 release
-    release_url = get_latest_release_url()
+    release_url = get_latest_release_url(session)
     if release_url:
         urls.append(release_url)
     
@@ -61,106 +101,156 @@ def get_desktop_path():
         desktop = home / "桌面"
     return desktop
 
-def download_file(url, dest_path, chunk_size=8192):
-    """下载文件并显示进度"""
+def download_file(session, url, chunk_size=1 << 20):
+    """下载文件到内存（过大时自动溢出到临时文件）并显示进度，返回文件对象"""
     print(f"正在下载: {url}")
-    print(f"保存到: {dest_path}")
     
+    buffer = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
     try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+        # 用 with 保证出错时也关闭响应；错误响应先读完（通常很短），连接才能放回连接池供下一个 URL 复用
+        with session.get(url, stream=True, timeout=30) as response:
+            if not response.ok:
+                response.content
+            response.raise_for_status()
+            
+            total_size = int(response.headers.get('content-length', 0))
+            total_mb = total_size / 1024 / 1024
+            downloaded = 0
+            last_printed = 0
+            
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    buffer.write(chunk)
+                    downloaded += len(chunk)
+                    # 每 4 MB 或下载结束时才刷新一次进度
+                    if total_size > 0 and (downloaded - last_printed >= PROGRESS_INTERVAL or downloaded >= total_size):
+                        last_printed = downloaded
+                        print("\r  进度: %.1f%% (%.1f MB / %.1f MB)" % (downloaded * 100 / total_size, downloaded / 1048576, total_mb), end='', flush=True)
     except requests.exceptions.RequestException as e:
+        buffer.close()
         raise Exception(f"下载失败: {e}")
-    
-    total_size = int(response.headers.get('content-length', 0))
-    downloaded = 0
-    
-    with open(dest_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=chunk_size):
-            if chunk:
-                f.write(chunk)
-                downloaded += len(chunk)
-                if total_size > 0:
-                    percent = (downloaded / total_size) * 100
-                    print(f"\r  进度: {percent:.1f}% ({downloaded / 1024 / 1024:.1f} MB / {total_size / 1024 / 1024:.1f} MB)", end='', flush=True)
+    except Exception:
+        buffer.close()
+        raise
     
     print()  # 换行
     print(f"✓ 下载完成")
+    buffer.seek(0)
+    return buffer
 
-def extract_zip(zip_path, extract_to):
+def extract_zip(zip_file, extract_to):
     """解压 ZIP 文件"""
-    print(f"\n正在解压: {zip_path.name}")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+    print(f"\n正在解压...")
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
         zip_ref.extractall(extract_to)
     print("✓ 解压完成")
 
 def find_dict_files(directory):
-    """查找所有 dict.yaml 文件"""
-    dict_files = []
-    for pattern in ['**/*.dict.yaml', '**/*.dict.yml']:
-        dict_files.extend(directory.glob(pattern))
-    return dict_files
+    """查找所有 dict.yaml 文件，返回字符串路径列表"""
+    exts = ('.dict.yaml', '.dict.yml')
+    return [os.path.join(root, name) for root, _, files in os.walk(directory) for name in files if name.endswith(exts)]
 
-def parse_dict_yaml(file_path):
-    """解析 Rime dict.yaml 文件，返回词条列表"""
-    entries = []
+def parse_dict_yaml(file_path, merged):
+    """解析 Rime dict.yaml 文件，直接合并进 merged（相同词条取最大权重），返回读取的词条数"""
+    count = 0
+    file_name = os.path.basename(file_path)
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 检查是否包含 import_tables（引用其他词库）
-        if 'import_tables:' in content:
-            # 这是一个引用文件，需要解析引用的词库
-            print(f"  注意: {file_path.name} 包含 import_tables，需要处理引用的词库")
-            # 这里可以递归处理，但为了简化，我们主要处理实际的词库文件
-        
-        # 查找数据部分（在 ... 之后）
-        lines = content.split('\n')
-        reached_payload = False
-        
-        for line in lines:
-            line = line.strip()
-            
-            if not reached_payload:
-                if line == '...':
-                    reached_payload = True
-                continue
+        with open(file_path, 'r', encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
+            # 头部（在 ... 之前）交给 libyaml 解析
+            header_lines = []
+            reached = False
+            for line in f:
+                if line.strip() == '...':
+                    reached = True
+                    break
+                header_lines.append(line)
+            if not reached:
+                return count
+            try:
+                header = yaml.load(''.join(header_lines), Loader=YAML_LOADER)
+            except yaml.YAMLError as e:
+                # 头部无法解析时仍然继续导入词条
+                print(f"  警告: {file_name} 的头部无法解析: {e}")
+                header = None
             
-            if not line or line.startswith('#'):
-                continue
+            # 检查是否包含 import_tables（引用其他词库）
+            if isinstance(header, dict) and 'import_tables' in header:
+                # 这是一个引用文件，需要解析引用的词库
+                print(f"  注意: {file_name} 包含 import_tables，需要处理引用的词库")
+                # 这里可以递归处理，但为了简化，我们主要处理实际的词库文件
             
-            # 解析词条：格式为 "词\t拼音\t权重" 或 "词\t拼音"
-            parts = line.split('\t')
-            if len(parts) < 2:
-                # 尝试空格分隔
-                parts = line.split()
-                if len(parts) < 2:
+            # 继续从同一个文件句柄流式读取数据部分；循环内用到的方法先绑定为局部变量
+            get = merged.get
+            startswith = str.startswith
+            strip = str.strip
+            split = str.split
+            _int = int
+            for line in f:
+                # 只有行首是空白（缩进、空行）时才完整 strip，其余行直接按首字符跳过注释
+                if line[:1].isspace():
+                    line = strip(line)
+                if not line or startswith(line, '#'):
                     continue
-            
-            word = parts[0].strip()
-            code = parts[1].strip()
-            weight = int(parts[2].strip()) if len(parts) >= 3 else 0
-            
-            if word and code:
-                entries.append((word, code, weight))
+                
+                # 解析词条：格式为 "词\t拼音\t权重" 或 "词\t拼音"；行尾换行会随最后一列一起被 strip
+                # 字段没有多余空白时 strip 返回原字符串，不会新建对象
+                parts = split(line, '\t', 3)
+                code = strip(parts[1]) if len(parts) >= 2 else ''
+                if not code:
+                    # 没有 Tab，或 Tab 只出现在行尾空白中（如 "词 ci 5\t"）：与原来一样先 strip 整行再切分
+                    line = strip(line)
+                    parts = split(line, '\t', 3)
+                    if len(parts) < 2:
+                        # 尝试空格分隔
+                        parts = split(line)
+                        if len(parts) < 2:
+                            continue
+                    code = strip(parts[1])
+                word = strip(parts[0])
+                weight = strip(parts[2]) if len(parts) >= 3 else ''
+                weight = _int(weight) if weight else 0
+                
+                if word and code:
+                    key = (word, code)
+                    previous = get(key)
+                    if previous is None or weight > previous:
+                        merged[key] = weight
+                    count += 1
     
     except Exception as e:
-        print(f"  警告: 解析 {file_path.name} 时出错: {e}")
+        print(f"  警告: 解析 {file_name} 时出错: {e}")
     
-    return entries
+    return count
 
-def merge_entries(all_entries):
-    """合并词条，相同词条取最大权重"""
-    merged = {}
-    for word, code, weight in all_entries:
-        key = (word, code)
-        if key in merged:
-            merged[key] = max(merged[key], weight)
-        else:
-            merged[key] = weight
+def normalize_code(code):
+    """规范化拼音编码：小写并去掉分隔符，与 convert_rime_dict.swift 保持一致"""
+    return code.lower().replace("'", "").replace(" ", "")
+
+def export_sqlite(entries, output_sqlite):
+    """在单个事务中批量写入 SQLite，写完后再建索引"""
+    if output_sqlite.exists():
+        output_sqlite.unlink()
     
-    return [(word, code, weight) for (word, code), weight in merged.items()]
+    conn = sqlite3.connect(str(output_sqlite), isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(SQLITE_CREATE_TABLE)
+        conn.execute("BEGIN")
+        for start in range(0, len(entries), SQLITE_BATCH_SIZE):
+            batch = entries[start:start + SQLITE_BATCH_SIZE]
+            conn.executemany(SQLITE_INSERT, [(code, normalize_code(code), word, weight) for word, code, weight in batch])
+        conn.execute(SQLITE_CREATE_INDEX)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+def write_entries(f, entries):
+    """按批拼接词条行后再写入，减少 write 调用次数"""
+    for start in range(0, len(entries), WRITE_BATCH_SIZE):
+        batch = entries[start:start + WRITE_BATCH_SIZE]
+        f.write(''.join([f"{word}\t{code}\t{weight}\n" for word, code, weight in batch]))
 
 def main():
     print("=" * 60)
@@ -190,29 +280,26 @@ def main():
             print(f"目录: {extract_to}")
         else:
             # 下载 rime-ice
-            zip_path = temp_dir / "rime-ice.zip"
             print(f"\n步骤 1: 下载 rime-ice")
             print("-" * 60)
             
-            # 尝试多个 URL
-            download_success = False
+            # 尝试多个 URL，共用同一个会话以复用 TCP/TLS 连接
+            zip_file = None
             last_error = None
-            download_urls = get_download_urls()
-            
-            for url in download_urls:
-                try:
-                    print(f"\n尝试 URL: {url}")
-                    download_file(url, zip_path)
-                    download_success = True
-                    break
-                except Exception as e:
-                    last_error = e
-                    print(f"  ✗ 失败: {e}")
-                    if zip_path.exists():
-                        zip_path.unlink()  # 删除部分下载的文件
-                    continue
+            with create_session() as session:
+                download_urls = get_download_urls(session)
+                
+                for url in download_urls:
+                    try:
+                        print(f"\n尝试 URL: {url}")
+                        zip_file = download_file(session, url)
+                        break
+                    except Exception as e:
+                        last_error = e
+                        print(f"  ✗ 失败: {e}")
+                        continue
             
-            if not download_success:
+            if zip_file is None:
                 print(f"\n✗ 所有下载 URL 都失败了")
                 print(f"最后错误: {last_error}")
                 print(f"\n提示: 您可以手动从以下地址下载 rime-ice:")
@@ -226,7 +313,8 @@ def main():
             print("-" * 60)
             extract_to = temp_dir / "extracted"
             extract_to.mkdir(exist_ok=True)
-            extract_zip(zip_path, extract_to)
+            with zip_file:
+                extract_zip(zip_file, extract_to)
         
         # 查找 rime-ice 目录
         print(f"\n查找 rime-ice 目录...")
@@ -312,7 +400,7 @@ def main():
         
         print(f"找到 {len(dict_files)} 个词库文件:")
         for f in dict_files[:10]:  # 只显示前10个
-            print(f"  - {f.relative_to(rime_ice_dir)}")
+            print(f"  - {os.path.relpath(f, rime_ice_dir)}")
         if len(dict_files) > 10:
             print(f"  ... 还有 {len(dict_files) - 10} 个文件")
         
@@ -320,29 +408,32 @@ def main():
         step_num = 4 if not local_dir else 3
         print(f"\n步骤 {step_num}: 解析词库文件")
         print("-" * 60)
-        all_entries = []
+        merged = {}
+        total_entries = 0
         total_files = len(dict_files)
         
         for idx, dict_file in enumerate(dict_files, 1):
-            print(f"[{idx}/{total_files}] {dict_file.name}", end=' ... ')
-            entries = parse_dict_yaml(dict_file)
-            all_entries.extend(entries)
-            print(f"{len(entries)} 条词条")
+            print(f"[{idx}/{total_files}] {os.path.basename(dict_file)}", end=' ... ')
+            count = parse_dict_yaml(dict_file, merged)
+            total_entries += count
+            print(f"{count} 条词条")
         
-        print(f"\n总共收集到 {len(all_entries)} 条词条")
+        print(f"\n总共收集到 {total_entries} 条词条")
         
         # 合并重复词条
         step_num = 5 if not local_dir else 4
         print(f"\n步骤 {step_num}: 合并重复词条")
         print("-" * 60)
-        merged_entries = merge_entries(all_entries)
+        # 解析时已取最大权重，这里只需展开为列表
+        merged_entries = [(word, code, weight) for (word, code), weight in merged.items()]
+        del merged
         print(f"合并后: {len(merged_entries)} 条唯一词条")
         
         # 按权重排序
         step_num = 6 if not local_dir else 5
         print(f"\n步骤 {step_num}: 按权重排序")
         print("-" * 60)
-        merged_entries.sort(key=lambda x: x[2], reverse=True)
+        merged_entries.sort(key=itemgetter(2), reverse=True)
         print("✓ 排序完成")
         
         # 生成 YAML 文件
@@ -361,8 +452,7 @@ def main():
             f.write("sort: by_weight\n")
             f.write("...\n\n")
             
-            for word, code, weight in merged_entries:
-                f.write(f"{word}\t{code}\t{weight}\n")
+            write_entries(f, merged_entries)
         
         yaml_size = output_yaml.stat().st_size / 1024 / 1024
         print(f"✓ YAML 文件生成完成: {len(merged_entries)} 条词条, {yaml_size:.2f} MB")
@@ -373,46 +463,23 @@ def main():
         print("-" * 60)
         
         project_root = Path(__file__).parent.parent
-        convert_script = project_root / "Tools" / "convert_rime_dict.swift"
         output_sqlite = project_root / "WTRimeKeyboard" / "Resources" / "rime_lexicon.sqlite"
         
         # 确保输出目录存在
         output_sqlite.parent.mkdir(parents=True, exist_ok=True)
         
-        print(f"转换脚本: {convert_script.name}")
-        print(f"输入文件: {output_yaml.name}")
         print(f"输出文件: {output_sqlite}")
         
         try:
-            result = subprocess.run(
-                ["swift", str(convert_script), str(output_yaml), str(output_sqlite)],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            print(result.stdout)
-            if result.stderr:
-                print("警告:", result.stderr)
-            
-            if output_sqlite.exists():
-                sqlite_size = output_sqlite.stat().st_size / 1024 / 1024
-                print(f"\n✓ SQLite 文件生成成功: {sqlite_size:.2f} MB")
-                print(f"✓ 文件位置: {output_sqlite}")
-            else:
-                print("\n✗ SQLite 文件未生成")
-                sys.exit(1)
-                
-        except subprocess.CalledProcessError as e:
-            print(f"\n✗ 转换失败:")
-            print(e.stdout)
-            print(e.stderr)
-            sys.exit(1)
-        except FileNotFoundError:
-            print(f"\n✗ 错误: 找不到 Swift 转换脚本: {convert_script}")
-            print("请确保 convert_rime_dict.swift 文件存在")
+            export_sqlite(merged_entries, output_sqlite)
+        except sqlite3.Error as e:
+            print(f"\n✗ 转换失败: {e}")
             sys.exit(1)
         
+        sqlite_size = output_sqlite.stat().st_size / 1024 / 1024
+        print(f"\n✓ SQLite 文件生成成功: {len(merged_entries)} 条词条, {sqlite_size:.2f} MB")
+        print(f"✓ 文件位置: {output_sqlite}")
+        
         print("\n" + "=" * 60)
         print("✓ 全部完成！")
         print("=" * 60)
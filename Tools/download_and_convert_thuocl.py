@@ -5,12 +5,18 @@
 """
 
 import os
+import multiprocessing
 import sys
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import shutil
+from operator import itemgetter
 from pathlib import Path
 from pypinyin import lazy_pinyin, Style
+from pypinyin.contrib.tone_convert import to_normal
+from pypinyin.phrases_dict import phrases_dict
+from pypinyin.pinyin_dict import pinyin_dict
 
 # THUOCL 词库下载链接（GitHub raw 链接）
 THUOCL_BASE_URL = "https://raw.githubusercontent.com/thunlp/THUOCL/master/data"
@@ -28,6 +34,15 @@ DICTIONARIES = [
     ("动物", "THUOCL_dongwu.txt"),
 ]
 
+# 下载进度的刷新间隔（字节）
+PROGRESS_INTERVAL = 4 << 20
+
+# 每个进程一次领取的词条数，用于摊薄进程间通信开销
+PINYIN_CHUNK_SIZE = 2000
+
+# 写入 YAML 时每批拼接的行数
+WRITE_BATCH_SIZE = 10000
+
 def get_desktop_path():
     """获取桌面路径"""
     home = Path.home()
@@ -40,7 +55,13 @@ def get_desktop_path():
         desktop = Path.cwd()
     return desktop
 
-def download_file_with_retry(url, output_path, retry_delay=3):
+def create_session():
+    """创建下载用的 HTTP 会话，多次请求复用连接"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(max_retries=3, pool_connections=4))
+    return session
+
+def download_file_with_retry(session, url, output_path, retry_delay=3, chunk_size=1 << 20):
     """下载文件，失败时无限重试"""
     attempt = 0
     while True:
@@ -51,21 +72,26 @@ def download_file_with_retry(url, output_path, retry_delay=3):
         
         try:
             print(f"正在下载: {os.path.basename(output_path)}")
-            response = requests.get(url, timeout=60, stream=True)
-            response.raise_for_status()
-            
-            # 获取文件大小
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            print(f"\r  进度: {percent:.1f}% ({downloaded}/{total_size} bytes)", end='', flush=True)
+            # 用 with 保证出错时也关闭响应；错误响应先读完（通常很短），连接才能放回连接池供重试复用
+            with session.get(url, timeout=60, stream=True) as response:
+                if not response.ok:
+                    response.content
+                response.raise_for_status()
+                
+                # 获取文件大小
+                total_size = int(response.headers.get('content-length', 0))
+                downloaded = 0
+                last_printed = 0
+                
+                with open(output_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            # 每 4 MB 或下载结束时才刷新一次进度
+                            if total_size > 0 and (downloaded - last_printed >= PROGRESS_INTERVAL or downloaded >= total_size):
+                                last_printed = downloaded
+                                print("\r  进度: %.1f%% (%d/%d bytes)" % (downloaded * 100 / total_size, downloaded, total_size), end='', flush=True)
             
             print(f"\n✓ 下载成功: {os.path.basename(output_path)}")
             return True
@@ -74,6 +100,39 @@ def download_file_with_retry(url, output_path, retry_delay=3):
         except Exception as e:
             print(f"\n✗ 发生错误: {e}")
 
+def build_pinyin_table(words):
+    """为不需要分词就能确定读音的词建立 词→拼音 表
+
+    整词收录在 pypinyin 词组词典中的词直接取词典读音；单字词取单字拼音表中的第一个读音；
+    只含单音字的词按字查单字拼音表拼接。这几种情况都与 lazy_pinyin 的结果一致，
+    其余词不入表，仍交给 word_to_pinyin。
+    """
+    # 带声调的音节只有一千多个，每个音节只去一次声调
+    syllables = {}
+    chars = {}
+    for char in set().union(*words):
+        value = pinyin_dict.get(ord(char))
+        if value and ',' not in value:
+            chars[char] = syllables.get(value) or syllables.setdefault(value, to_normal(value))
+    table = {}
+    for word in words:
+        readings = phrases_dict.get(word)
+        if readings is not None:
+            pinyins = [syllables.get(reading[0]) or syllables.setdefault(reading[0], to_normal(reading[0]))
+                       for reading in readings]
+        elif len(word) == 1:
+            value = pinyin_dict.get(ord(word))
+            if value is None:
+                continue
+            value = value.split(',', 1)[0]
+            pinyins = [syllables.get(value) or syllables.setdefault(value, to_normal(value))]
+        else:
+            pinyins = [chars.get(char) for char in word]
+            if None in pinyins:
+                continue
+        table[word] = ''.join(pinyins).lower()
+    return table
+
 def word_to_pinyin(word):
     """将中文词转换为拼音（不带声调，小写）"""
     try:
@@ -83,6 +142,12 @@ def word_to_pinyin(word):
         # 如果转换失败，返回空字符串
         return ""
 
+def write_entries(f, entries):
+    """按批拼接词条行后再写入，减少 write 调用次数"""
+    for start in range(0, len(entries), WRITE_BATCH_SIZE):
+        batch = entries[start:start + WRITE_BATCH_SIZE]
+        f.write(''.join([f"{word}\t{pinyin}\t{weight}\n" for word, pinyin, weight in batch]))
+
 def main():
     print("=" * 60)
     print("THUOCL 词库下载与转换工具")
@@ -99,55 +164,56 @@ def main():
     temp_dir = Path("/tmp/thuocl_download")
     temp_dir.mkdir(exist_ok=True)
     
-    # 下载所有词库
+    # 下载所有词库，共用同一个会话以复用 TCP/TLS 连接
     all_words = {}
     downloaded_count = 0
     
-    for name, filename in DICTIONARIES:
-        url = f"{THUOCL_BASE_URL}/{filename}"
-        local_file = temp_dir / filename
-        
-        print(f"\n[{downloaded_count + 1}/{len(DICTIONARIES)}] 处理词库: {name}")
-        print("-" * 60)
-        
-        # 无限重试下载
-        download_file_with_retry(url, str(local_file))
-        
-        # 读取并合并词条
-        if local_file.exists():
-            print(f"正在解析 {name}...")
-            word_count = 0
-            with open(local_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    parts = line.split('\t')
-                    if len(parts) < 2:
-                        continue
-                    
-                    word = parts[0].strip()
-                    try:
-                        df_value = int(parts[1].strip())
-                    except ValueError:
-                        continue
-                    
-                    if not word:
-                        continue
-                    
-                    # 合并相同词条，取最大DF值
-                    if word in all_words:
-                        all_words[word] = max(all_words[word], df_value)
-                    else:
-                        all_words[word] = df_value
-                    
-                    word_count += 1
+    with create_session() as session:
+        for name, filename in DICTIONARIES:
+            url = f"{THUOCL_BASE_URL}/{filename}"
+            local_file = temp_dir / filename
             
-            print(f"✓ {name}: {word_count} 条词条")
-            downloaded_count += 1
-        else:
-            print(f"✗ {name}: 文件不存在，跳过")
+            print(f"\n[{downloaded_count + 1}/{len(DICTIONARIES)}] 处理词库: {name}")
+            print("-" * 60)
+            
+            # 无限重试下载
+            download_file_with_retry(session, url, str(local_file))
+            
+            # 读取并合并词条
+            if local_file.exists():
+                print(f"正在解析 {name}...")
+                word_count = 0
+                with open(local_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        
+                        parts = line.split('\t')
+                        if len(parts) < 2:
+                            continue
+                        
+                        word = parts[0].strip()
+                        try:
+                            df_value = int(parts[1].strip())
+                        except ValueError:
+                            continue
+                        
+                        if not word:
+                            continue
+                        
+                        # 合并相同词条，取最大DF值
+                        if word in all_words:
+                            all_words[word] = max(all_words[word], df_value)
+                        else:
+                            all_words[word] = df_value
+                        
+                        word_count += 1
+                
+                print(f"✓ {name}: {word_count} 条词条")
+                downloaded_count += 1
+            else:
+                print(f"✗ {name}: 文件不存在，跳过")
     
     print(f"\n" + "=" * 60)
     print(f"总共收集到 {len(all_words)} 个唯一词条")
@@ -160,8 +226,17 @@ def main():
     total = 0
     failed_pinyin = 0
     
+    # 能直接查表的词先建表，只有表中没有的词才交给 lazy_pinyin 分词
+    pinyin_table = build_pinyin_table(all_words)
+    misses = [word for word in all_words if word not in pinyin_table]
+    
+    # 分词是纯 CPU 计算，分发到多个进程并行处理（imap 保持顺序，便于与原词条对应）
+    if misses:
+        with multiprocessing.Pool() as pool:
+            pinyin_table.update(zip(misses, pool.imap(word_to_pinyin, misses, chunksize=PINYIN_CHUNK_SIZE)))
+    
     for word, df_value in all_words.items():
-        pinyin = word_to_pinyin(word)
+        pinyin = pinyin_table[word]
         if not pinyin:
             failed_pinyin += 1
             continue
@@ -177,7 +252,7 @@ def main():
     
     # 按权重降序排序
     print("\n正在按权重排序...")
-    entries.sort(key=lambda x: x[2], reverse=True)
+    entries.sort(key=itemgetter(2), reverse=True)
     
     # 写入 Rime dict.yaml 格式
     print(f"\n正在写入 {output_yaml}...")
@@ -190,8 +265,7 @@ def main():
         f.write("sort: by_weight\n")
         f.write("...\n\n")
         
-        for word, pinyin, weight in entries:
-            f.write(f"{word}\t{pinyin}\t{weight}\n")
+        write_entries(f, entries)
     
     print("=" * 60)
     print(f"✓ 完成！共生成 {len(entries)} 条词条")
@@ -5,10 +5,53 @@
 """
 
 import os
+import multiprocessing
+import re
+import sqlite3
 import sys
-import subprocess
+from operator import itemgetter
 from pathlib import Path
 from pypinyin import lazy_pinyin, Style
+from pypinyin.contrib.tone_convert import to_normal
+from pypinyin.phrases_dict import phrases_dict
+from pypinyin.pinyin_dict import pinyin_dict
+
+# 词条行：词语后跟分隔符，再跟权重/DF值（第二列整列交给 int() 解析，可以为空）；跳过 # 注释行
+# Tab 分隔时分隔符之后必须还有内容，与原来先 strip 整行再判断是否含 Tab 一致
+# 同一个文件的分隔符是一致的，按文件选定一个分隔符对应的正则
+ENTRY_PATTERNS = {
+    b'\t': re.compile(rb'(?m)^[ \t]*([^\s#][^\t\r\n]*?)[ ]*\t(?=[^\S\r\n]*\S)([^\t\r\n]*)'),
+    b' ': re.compile(rb'(?m)^[ \t]*([^\s#]\S*)[ \t]+(\S+)'),
+    b',': re.compile(rb'(?m)^[ \t]*([^\s#,][^,\r\n]*?)[ \t]*,([^,\r\n]*)'),
+}
+
+# 用于判断分隔符的非注释行数
+SEPARATOR_SAMPLE_LINES = 10
+
+# 按块读取词库文件，避免逐行进入 Python 循环
+READ_CHUNK_SIZE = 4 << 20
+
+# 每个进程一次领取的词条数，用于摊薄进程间通信开销
+PINYIN_CHUNK_SIZE = 2000
+
+# SQLite 表结构，与 convert_rime_dict.swift 生成的数据库保持一致
+SQLITE_CREATE_TABLE = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    code_raw TEXT NOT NULL,
+    code_norm TEXT NOT NULL,
+    word TEXT NOT NULL,
+    weight INTEGER DEFAULT 0
+)
+"""
+SQLITE_CREATE_INDEX = "CREATE INDEX idx_entries_code_norm ON entries(code_norm)"
+SQLITE_INSERT = "INSERT INTO entries (code_raw, code_norm, word, weight) VALUES (?, ?, ?, ?)"
+
+# 每次 executemany 提交的行数
+SQLITE_BATCH_SIZE = 50000
+
+# 写入 YAML 时每批拼接的行数
+WRITE_BATCH_SIZE = 10000
 
 def get_desktop_path():
     """获取桌面路径"""
@@ -18,6 +61,39 @@ def get_desktop_path():
         desktop = home / "桌面"
     return desktop
 
+def build_pinyin_table(words):
+    """为不需要分词就能确定读音的词建立 词→拼音 表
+
+    整词收录在 pypinyin 词组词典中的词直接取词典读音；单字词取单字拼音表中的第一个读音；
+    只含单音字的词按字查单字拼音表拼接。这几种情况都与 lazy_pinyin 的结果一致，
+    其余词不入表，仍交给 word_to_pinyin。
+    """
+    # 带声调的音节只有一千多个，每个音节只去一次声调
+    syllables = {}
+    chars = {}
+    for char in set().union(*words):
+        value = pinyin_dict.get(ord(char))
+        if value and ',' not in value:
+            chars[char] = syllables.get(value) or syllables.setdefault(value, to_normal(value))
+    table = {}
+    for word in words:
+        readings = phrases_dict.get(word)
+        if readings is not None:
+            pinyins = [syllables.get(reading[0]) or syllables.setdefault(reading[0], to_normal(reading[0]))
+                       for reading in readings]
+        elif len(word) == 1:
+            value = pinyin_dict.get(ord(word))
+            if value is None:
+                continue
+            value = value.split(',', 1)[0]
+            pinyins = [syllables.get(value) or syllables.setdefault(value, to_normal(value))]
+        else:
+            pinyins = [chars.get(char) for char in word]
+            if None in pinyins:
+                continue
+        table[word] = ''.join(pinyins).lower()
+    return table
+
 def word_to_pinyin(word):
     """将中文词转换为拼音（不带声调，小写）"""
     try:
@@ -26,50 +102,70 @@ def word_to_pinyin(word):
     except Exception:
         return ""
 
+def detect_separator(sample):
+    """根据前几行非注释内容判断分隔符：Tab、空格或逗号中出现最多的一个"""
+    counts = dict.fromkeys(ENTRY_PATTERNS, 0)
+    checked = 0
+    for line in sample.splitlines():
+        line = line.strip()
+        if not line or line.startswith(b'#'):
+            continue
+        for sep in counts:
+            if sep in line:
+                counts[sep] += 1
+        checked += 1
+        if checked >= SEPARATOR_SAMPLE_LINES:
+            break
+    # 次数相同时按 Tab、空格、逗号的优先级选择
+    return max(counts, key=counts.get)
+
 def parse_dict_file(file_path):
     """解析词库文件（支持多种格式）"""
     words = {}
     print(f"  正在解析: {file_path.name}")
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            line_count = 0
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                # 尝试多种分隔符：Tab、空格、逗号
-                parts = None
-                if '\t' in line:
-                    parts = line.split('\t')
-                elif ' ' in line and len(line.split()) >= 2:
-                    parts = line.split()
-                elif ',' in line:
-                    parts = line.split(',')
-                
-                if not parts or len(parts) < 2:
-                    continue
-                
-                word = parts[0].strip()
-                if not word:
-                    continue
-                
-                # 尝试解析权重/DF值
-                try:
-                    weight = int(parts[1].strip())
-                except (ValueError, IndexError):
-                    weight = 0
-                
-                # 合并相同词条，取最大权重
-                if word in words:
-                    words[word] = max(words[word], weight)
+        with open(file_path, 'rb') as f:
+            bytes_read = 0
+            tail = b''
+            pattern = None
+            # 循环内用到的方法先绑定为局部变量
+            get = words.get
+            decode = bytes.decode
+            _int = int
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if pattern is None:
+                    pattern = ENTRY_PATTERNS[detect_separator(chunk)]
+                if not chunk:
+                    data = tail
                 else:
-                    words[word] = weight
+                    # 保留最后一个不完整的行，与下一块拼接
+                    data = tail + chunk
+                    cut = data.rfind(b'\n') + 1
+                    data, tail = data[:cut], data[cut:]
                 
-                line_count += 1
-                if line_count % 10000 == 0:
-                    print(f"    已读取 {line_count} 行...", end='\r')
+                for word, weight in pattern.findall(data):
+                    # 尝试解析权重/DF值（与 int() 一样允许正负号和首尾空白）
+                    try:
+                        weight = _int(weight)
+                    except ValueError:
+                        # bytes 只认 ASCII 数字，其他数字字符解码后再试一次
+                        try:
+                            weight = _int(decode(weight, 'utf-8'))
+                        except ValueError:
+                            weight = 0
+                    word = decode(word, 'utf-8')
+                    
+                    # 合并相同词条，取最大权重
+                    previous = get(word)
+                    if previous is None or weight > previous:
+                        words[word] = weight
+                
+                if not chunk:
+                    break
+                bytes_read += len(chunk)
+                print(f"    已读取 {bytes_read / 1024 / 1024:.1f} MB...", end='\r')
         
         print(f"    ✓ 解析完成: {len(words)} 个词条")
         return words
@@ -77,6 +173,41 @@ def parse_dict_file(file_path):
         print(f"    ✗ 解析失败: {e}")
         return {}
 
+def merge_max(all_words, words):
+    """将 words 合并进 all_words，相同词条取最大权重"""
+    get = all_words.get
+    # 新词的默认值取 weight - 1，负权重的新词也能并入
+    all_words.update({word: weight for word, weight in words.items() if weight > get(word, weight - 1)})
+
+def normalize_code(code):
+    """规范化拼音编码：小写并去掉分隔符，与 convert_rime_dict.swift 保持一致"""
+    return code.lower().replace("'", "").replace(" ", "")
+
+def export_sqlite(entries, output_sqlite):
+    """在单个事务中批量写入 SQLite，写完后再建索引"""
+    if output_sqlite.exists():
+        output_sqlite.unlink()
+    
+    conn = sqlite3.connect(str(output_sqlite), isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(SQLITE_CREATE_TABLE)
+        conn.execute("BEGIN")
+        for start in range(0, len(entries), SQLITE_BATCH_SIZE):
+            batch = entries[start:start + SQLITE_BATCH_SIZE]
+            conn.executemany(SQLITE_INSERT, [(pinyin, normalize_code(pinyin), word, weight) for word, pinyin, weight in batch])
+        conn.execute(SQLITE_CREATE_INDEX)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+def write_entries(f, entries):
+    """按批拼接词条行后再写入，减少 write 调用次数"""
+    for start in range(0, len(entries), WRITE_BATCH_SIZE):
+        batch = entries[start:start + WRITE_BATCH_SIZE]
+        f.write(''.join([f"{word}\t{pinyin}\t{weight}\n" for word, pinyin, weight in batch]))
+
 def main():
     print("=" * 60)
     print("本地词库整合工具")
@@ -93,11 +224,9 @@ def main():
     
     print(f"\n词库文件夹: {cihui_dir}")
     
-    # 查找所有词库文件
-    dict_files = []
-    for ext in ['*.txt', '*.dict', '*.yaml', '*.yml']:
-        dict_files.extend(list(cihui_dir.glob(ext)))
-        dict_files.extend(list(cihui_dir.rglob(ext)))  # 递归查找子文件夹
+    # 查找所有词库文件（一次遍历，包含子文件夹），去重并排序，保证每个文件只解析一次
+    exts = ('.txt', '.dict', '.yaml', '.yml')
+    dict_files = sorted({Path(root) / name for root, _, files in os.walk(cihui_dir) for name in files if name.endswith(exts)})
     
     if not dict_files:
         print("\n✗ 错误: 在词库文件夹中未找到任何词库文件")
@@ -121,11 +250,7 @@ def main():
         print("-" * 60)
         
         words = parse_dict_file(dict_file)
-        for word, weight in words.items():
-            if word in all_words:
-                all_words[word] = max(all_words[word], weight)
-            else:
-                all_words[word] = weight
+        merge_max(all_words, words)
     
     print("\n" + "=" * 60)
     print(f"总共收集到 {len(all_words)} 个唯一词条")
@@ -139,8 +264,17 @@ def main():
     total = 0
     failed_pinyin = 0
     
+    # 能直接查表的词先建表，只有表中没有的词才交给 lazy_pinyin 分词
+    pinyin_table = build_pinyin_table(all_words)
+    misses = [word for word in all_words if word not in pinyin_table]
+    
+    # 分词是纯 CPU 计算，分发到多个进程并行处理（imap 保持顺序，便于与原词条对应）
+    if misses:
+        with multiprocessing.Pool() as pool:
+            pinyin_table.update(zip(misses, pool.imap(word_to_pinyin, misses, chunksize=PINYIN_CHUNK_SIZE)))
+    
     for word, weight in all_words.items():
-        pinyin = word_to_pinyin(word)
+        pinyin = pinyin_table[word]
         if not pinyin:
             failed_pinyin += 1
             continue
@@ -155,7 +289,7 @@ def main():
     
     # 按权重降序排序
     print("\n正在按权重排序...")
-    entries.sort(key=lambda x: x[2], reverse=True)
+    entries.sort(key=itemgetter(2), reverse=True)
     
     # 生成 yaml 文件
     output_yaml = desktop / "rime_lexicon.yaml"
@@ -169,8 +303,7 @@ def main():
         f.write("sort: by_weight\n")
         f.write("...\n\n")
         
-        for word, pinyin, weight in entries:
-            f.write(f"{word}\t{pinyin}\t{weight}\n")
+        write_entries(f, entries)
     
     yaml_size = output_yaml.stat().st_size / 1024 / 1024
     print(f"✓ YAML 文件生成完成: {len(entries)} 条词条, {yaml_size:.2f} MB")
@@ -181,48 +314,24 @@ def main():
     print("=" * 60)
     
     project_root = Path(__file__).parent.parent
-    convert_script = project_root / "Tools" / "convert_rime_dict.swift"
     output_sqlite = project_root / "WTRimeKeyboard" / "Resources" / "rime_lexicon.sqlite"
     
     # 确保输出目录存在
     output_sqlite.parent.mkdir(parents=True, exist_ok=True)
     
-    print(f"\n转换脚本: {convert_script}")
-    print(f"输入文件: {output_yaml}")
-    print(f"输出文件: {output_sqlite}")
+    print(f"\n输出文件: {output_sqlite}")
     print("-" * 60)
     
     try:
-        # 调用 Swift 转换脚本
-        result = subprocess.run(
-            ["swift", str(convert_script), str(output_yaml), str(output_sqlite)],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        print(result.stdout)
-        if result.stderr:
-            print("警告:", result.stderr)
-        
-        if output_sqlite.exists():
-            sqlite_size = output_sqlite.stat().st_size / 1024 / 1024
-            print(f"\n✓ SQLite 文件生成成功: {sqlite_size:.2f} MB")
-            print(f"✓ 文件位置: {output_sqlite}")
-        else:
-            print("\n✗ SQLite 文件未生成")
-            sys.exit(1)
-            
-    except subprocess.CalledProcessError as e:
-        print(f"\n✗ 转换失败:")
-        print(e.stdout)
-        print(e.stderr)
-        sys.exit(1)
-    except FileNotFoundError:
-        print(f"\n✗ 错误: 找不到 Swift 转换脚本: {convert_script}")
-        print("请确保 convert_rime_dict.swift 文件存在")
+        export_sqlite(entries, output_sqlite)
+    except sqlite3.Error as e:
+        print(f"\n✗ 转换失败: {e}")
         sys.exit(1)
     
+    sqlite_size = output_sqlite.stat().st_size / 1024 / 1024
+    print(f"\n✓ SQLite 文件生成成功: {len(entries)} 条词条, {sqlite_size:.2f} MB")
+    print(f"✓ 文件位置: {output_sqlite}")
+    
     print("\n" + "=" * 60)
     print("✓ 全部完成！")
     print("=" * 60)